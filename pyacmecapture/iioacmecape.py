@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Baylibre's ACME Cape Abstraction class
 
 Baylibre's ACME Cape Abstraction class.
@@ -9,12 +9,15 @@ and the work done on "pyacmegraph" tool done by:
     - Sebastien Jan <sjan@baylibre.com>.
 """
 
-from __future__ import print_function
 import traceback
-import xmlrpclib
+import re
+import socket
+import threading
+from time import monotonic
+from xmlrpc.client import ServerProxy, MultiCall, Fault
+from xmlrpc.client import Error as XMLRPCError
 import iio
 from mltrace import MLTrace
-from ping import ping
 from iioacmeprobe import IIOAcmeProbe
 
 
@@ -31,6 +34,19 @@ __version__ = "0.2"
 __deprecated__ = False
 
 
+# IIO daemon (iiod) TCP port
+_IIOD_PORT = 30431
+# ACME XMLRPC service TCP port
+_XMLRPC_PORT = 8000
+# Timeout (in seconds) of the connection used to check ACME cape is up
+_IS_UP_TIMEOUT = 1.0
+# Duration (in seconds) during which ACME cape status is not checked again
+_IS_UP_CACHE_TTL = 2.0
+# Probe details, as reported by ACME XMLRPC service
+_PROBE_TYPE_RE = re.compile(r"JACK|USB|HE10")
+_PROBE_SHUNT_RE = re.compile(r"R_Shunt:\s*(\d+)\s*uOhm")
+
+
 class IIOAcmeCape(object):
     """ Represent Baylibre's ACME cape.
 
@@ -54,8 +70,12 @@ class IIOAcmeCape(object):
         self._trace = MLTrace(verbose_level, "ACME Cape")
         self._iioctx = None
         self._slots = []
+        # Slots details retrieved from ACME XMLRPC service
+        self._slots_info = []
         # Hard-coded value until exported by ACME FW via IIO or XMLRPC service
         self._slots_count = 8
+        self._up = False
+        self._up_timestamp = None
 
     def is_up(self):
         """ Check if the ACME cape is up and running.
@@ -67,7 +87,25 @@ class IIOAcmeCape(object):
             bool: True if ACME cape is operational, False otherwise.
 
         """
-        return ping(self._ip)
+        # Connecting to the IIO daemon and XMLRPC service is cheaper than an
+        # ICMP ping and checks the services actually used.
+        # Result is cached for a while.
+        now = monotonic()
+        if (self._up_timestamp is not None and
+                now - self._up_timestamp < _IS_UP_CACHE_TTL):
+            return self._up
+        try:
+            for port in (_IIOD_PORT, _XMLRPC_PORT):
+                sock = socket.create_connection((self._ip, port),
+                                                _IS_UP_TIMEOUT)
+                sock.close()
+            self._up = True
+        except socket.error:
+            self._trace.trace(2, traceback.format_exc())
+            self._up = False
+        self._up_timestamp = now
+        self._trace.trace(1, "ACME cape %s.", "up" if self._up else "down")
+        return self._up
 
     def get_slot_count(self):
         """ Return the number of slots available on the cape.
@@ -79,80 +117,106 @@ class IIOAcmeCape(object):
             int: number of slots available on the cape (> 0).
 
         """
-        self._trace.trace(1, "Slot count: %u" % self._slots_count)
+        self._trace.trace(1, "Slot count: %u", self._slots_count)
         return self._slots_count
 
-    def _find_probes(self):
-        """ Enumerate ACEM probes attached to the ACME cape,
-            retrieving probe details.
+    def _read_slots_info(self):
+        """ Retrieve the details of all ACME cape slots, using ACME XMLRPC
+            service. Save them in self._slots_info (one entry per slot,
+            None if no detail could be retrieved).
             Private function, not to be used outside of the module.
 
         Args:
             None
 
         Returns:
-            bool: True if operation is successful, False otherwise.
+            None
 
         """
-        acme_server_address = "%s:%d" % (self._ip, 8000)
+        self._slots_info = []
+        acme_server_address = "%s:%d" % (self._ip, _XMLRPC_PORT)
 
         # Use ACME XMLRPC service
         try:
-            proxy = xmlrpclib.ServerProxy("http://%s/acme" % acme_server_address)
-        except:
+            proxy = ServerProxy("http://%s/acme" % acme_server_address)
+            # Batch all slots requests into a single HTTP round trip
+            multicall = MultiCall(proxy)
+            for i in range(1, self._slots_count + 1):
+                multicall.info("%s" % i)
+            try:
+                results = multicall()
+            except Fault:
+                # Older ACME XMLRPC service, without multicall support
+                self._trace.trace(1, "XMLRPC multicall not supported, "
+                                     "retrieving slots details one by one.")
+                self._trace.trace(2, traceback.format_exc())
+                results = None
+        except (OSError, XMLRPCError):
             self._trace.trace(1,
                               "Failed to use ACME XMLRPC service! (\"" +
                               acme_server_address + "\")")
             self._trace.trace(2, traceback.format_exc())
-            return False
+            return
         self._trace.trace(1, "ACME XMLRPC service ready.")
-        # Browse ACME slots one by one to find which ones are populated
-        iio_device_idx = 0
+        # Browse ACME slots one by one
         for i in range(1, self._slots_count + 1):
             try:
-                info = proxy.info("%s" % i)
+                if results is not None:
+                    info = results[i - 1]
+                else:
+                    info = proxy.info("%s" % i)
                 self._trace.trace(2, info)
-            except:
-                self._trace.trace(1, "No XMLRPC service found for slot %d." % i)
+            except (OSError, XMLRPCError):
+                self._trace.trace(1, "No XMLRPC service found for slot %d.", i)
+                self._trace.trace(2, traceback.format_exc())
+                info = None
+            self._slots_info.append(info)
+
+    def _find_probes(self):
+        """ Enumerate ACEM probes attached to the ACME cape,
+            from the retrieved slots details.
+            Private function, not to be used outside of the module.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if operation is successful, False otherwise.
+
+        """
+        self._slots = []
+        if not self._slots_info:
+            return False
+        # Browse ACME slots one by one to find which ones are populated
+        iio_device_idx = 0
+        for i, info in enumerate(self._slots_info, 1):
+            if info is None:
                 continue
             if info.find('Failed') != -1:
                 # Slot no used
-                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is empty." % i)
+                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is empty.", i)
                 self._slots.append(None)
             else:
-                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is used." % i)
+                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is used.", i)
                 # Retrieve probe type
-                if info.find("JACK") != -1:
-                    probe_type = "JACK"
-                elif info.find("USB") != -1:
-                    probe_type = "USB"
-                elif info.find("HE10") != -1:
-                    probe_type = "HE10"
-                else:
+                match = _PROBE_TYPE_RE.search(info)
+                if match is None:
                     self._trace.trace(1, "XMLRPC: probe type not found?!")
                     self._slots.append(None)
                     continue
+                probe_type = match.group(0)
                 self._trace.trace(2, "Probe type: " + probe_type)
 
                 # Retrieve shunt resistor value
-                pos1 = info.find("R_Shunt:")
-                if pos1 != -1:
-                    pos2 = info.find("uOhm")
-                    if pos2 != -1:
-                        shunt = info[pos1 + 9: pos2 - 1]
-                        self._trace.trace(2, "Probe shunt: " + shunt)
-                    else:
-                        self._trace.trace(1, "XMLRPC: probe shunt not found?!")
-                        continue
-                else:
+                match = _PROBE_SHUNT_RE.search(info)
+                if match is None:
                     self._trace.trace(1, "XMLRPC: probe shunt not found?!")
                     continue
+                shunt = match.group(1)
+                self._trace.trace(2, "Probe shunt: " + shunt)
 
                 # Retrieve power switch capability
-                if info.find("Has Power Switch") != -1:
-                    pwr_switch = True
-                else:
-                    pwr_switch = False
+                pwr_switch = "Has Power Switch" in info
                 self._trace.trace(2, "Probe power switch: " + str(pwr_switch))
 
                 # Create IIOAcmeProbe instance
@@ -176,17 +240,21 @@ class IIOAcmeCape(object):
         """
         self._trace.trace(3, "======== IIO context infos ========")
         self._trace.trace(3, "  Name: " + self._iioctx.name)
-        self._trace.trace(3, "  Library version: %u.%u (git tag: %s)" % self._iioctx.version)
-        self._trace.trace(3, "  Backend version: %u.%u (git tag: %s)" % self._iioctx.version)
+        self._trace.trace(3, "  Library version: %u.%u (git tag: %s)",
+                          *self._iioctx.version)
+        self._trace.trace(3, "  Backend version: %u.%u (git tag: %s)",
+                          *self._iioctx.version)
         self._trace.trace(3, "  Backend description string: " + self._iioctx.description)
         if len(self._iioctx.attrs) > 0:
-            self._trace.trace(3, "  Attributes: %u" % len(self._iioctx.attrs))
+            self._trace.trace(3, "  Attributes: %u", len(self._iioctx.attrs))
             for attr, value in self._iioctx.attrs.items():
                 self._trace.trace(3, "    " + attr + ": " + value)
         self._trace.trace(3, "===================================")
 
     def init(self):
         """ Configure IIOAcmeCape. Create IIO context, detect attached probes.
+            May be called again to detect probes again (e.g. after probes
+            were plugged or unplugged).
 
         Args:
             None
@@ -195,23 +263,32 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
+        # Retrieve slots details (XMLRPC) while connecting to ACME (IIO),
+        # these network operations being independent.
+        slots_info_thread = threading.Thread(target=self._read_slots_info)
+        slots_info_thread.start()
+
         # Connecting to ACME
         try:
-            self._trace.trace(1, "Connecting to %s..." % self._ip)
+            self._trace.trace(1, "Connecting to %s...", self._ip)
             self._iioctx = iio.Context("ip:" + self._ip)
         except OSError:
             self._trace.trace(1, "Connection timed out!")
+            slots_info_thread.join()
             return False
         except:
             self._trace.trace(2, traceback.format_exc())
+            slots_info_thread.join()
             return False
 
-        if self._verbose_level >= 2:
+        # Context details are only printed at trace level 3
+        if self._trace.is_enabled(3):
             self._show_iio_context_attributes()
 
         # There is not yet an attribute in the IIO device to indicate in which
         # ACME Cape slot the IIO device is attached. Hence, need to first find
         # the populated ACME Cape slot(s), and then save this info.
+        slots_info_thread.join()
         try:
             self._find_probes()
         except:
@@ -234,39 +311,58 @@ class IIOAcmeCape(object):
             # ACME slots are labelled from 1 to 8 on cape,
             # but handled from 0 to 7 in SW.
             if self._slots[slot - 1] is None:
-                self._trace.trace(1, "Slot %d not populated." % slot)
+                self._trace.trace(1, "Slot %d not populated.", slot)
                 return False
-            self._trace.trace(1, "Slot %d populated." % slot)
+            self._trace.trace(1, "Slot %d populated.", slot)
             return True
         except:
-            self._trace.trace(1, "Failed to determine slot %d status!" % slot)
+            self._trace.trace(1, "Failed to determine slot %d status!", slot)
             self._trace.trace(2, traceback.format_exc())
             return False
 
-    def enable_capture_channel(self, slot, channel, enable):
-        """ Enable/disable capture of selected channel.
+    def _call_probe(self, slot, method, err_msg, *args):
+        """ Call selected IIOAcmeProbe method on the probe of selected slot.
+            Private function, not to be used outside of the module.
 
         Args:
-            slot (int): ACME cape slot, as labelled on the cape (>0).
-            channel (string): channel to capture.
-            enable (bool): True to enable capture, False to disable it.
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+            method (function): IIOAcmeProbe method
+            err_msg (string): message to trace in case of error
+            args: method arguments
 
         Returns:
-            bool: True if operation is successful, False otherwise.
+            Value returned by the probe method, False in case of error.
 
         """
         try:
             # ACME slots are labelled from 1 to 8 on cape,
             # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].enable_capture_channel(channel, enable)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
+            probe = self._slots[slot - 1]
+            if probe is None:
+                self._trace.trace(1, "No probe in slot %d", slot)
+                return False
+            return method(probe, *args)
         except:
-            self._trace.trace(1, "Failed to configure capture channel (slot %d)!" % slot)
+            self._trace.trace(1, "%s (slot %d)!", err_msg, slot)
             self._trace.trace(2, traceback.format_exc())
             return False
 
+    def enable_capture_channel(self, slot, channel, enable):
+        """ Enable/disable capture of selected channel.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0).
+            channel (string): channel to capture.
+            enable (bool): True to enable capture, False to disable it.
+
+        Returns:
+            bool: True if operation is successful, False otherwise.
+
+        """
+        return self._call_probe(slot, IIOAcmeProbe.enable_capture_channel,
+                                "Failed to configure capture channel",
+                                channel, enable)
+
     def set_oversampling_ratio(self, slot, oversampling_ratio):
         """ Set the capture oversampling ratio of the selected probe.
 
@@ -278,17 +374,9 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].set_oversampling_ratio(oversampling_ratio)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to configure oversampling ratio (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.set_oversampling_ratio,
+                                "Failed to configure oversampling ratio",
+                                oversampling_ratio)
 
     def enable_asynchronous_reads(self, slot, enable):
         """ Enable asynchronous reads.
@@ -302,17 +390,9 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].enable_asynchronous_reads(enable)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to configure asynchronous reads (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.enable_asynchronous_reads,
+                                "Failed to configure asynchronous reads",
+                                enable)
 
     def get_sampling_frequency(self, slot):
         """ Return the capture sampling frequency (in Hertz).
@@ -325,17 +405,8 @@ class IIOAcmeCape(object):
                  Return 0 in case of error.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].get_sampling_frequency()
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to retrieve sampling frequency (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.get_sampling_frequency,
+                                "Failed to retrieve sampling frequency")
 
     def get_shunt(self, slot):
         """ Return the shunt resistor value of the probe in selected slot
@@ -348,17 +419,8 @@ class IIOAcmeCape(object):
                  False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].get_shunt()
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to retrieve shunt value (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.get_shunt,
+                                "Failed to retrieve shunt value")
 
     def allocate_capture_buffer(self, slot, samples_count, cyclic=False):
         """ Allocate buffer to store captured data.
@@ -373,17 +435,9 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].allocate_capture_buffer(samples_count, cyclic)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to allocate capture buffer (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.allocate_capture_buffer,
+                                "Failed to allocate capture buffer",
+                                samples_count, cyclic)
 
     def refill_capture_buffer(self, slot):
         """ Fill capture buffer with new samples.
@@ -395,17 +449,36 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].refill_capture_buffer()
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to refill capture buffer (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.refill_capture_buffer,
+                                "Failed to refill capture buffer")
+
+    def submit_refill_capture_buffer(self, slot):
+        """ Start filling capture buffer with new samples, in background.
+            Call wait_refill_capture_buffer() to wait for completion.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+
+        Returns:
+            bool: True if operation is successful, False otherwise.
+
+        """
+        return self._call_probe(slot, IIOAcmeProbe.submit_refill_capture_buffer,
+                                "Failed to submit capture buffer refill")
+
+    def wait_refill_capture_buffer(self, slot):
+        """ Wait for the refill started by submit_refill_capture_buffer()
+            to complete.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+
+        Returns:
+            bool: True if buffer was successfully refilled, False otherwise.
+
+        """
+        return self._call_probe(slot, IIOAcmeProbe.wait_refill_capture_buffer,
+                                "Failed to wait capture buffer refill")
 
     def read_capture_buffer(self, slot, channel):
         """ Return the samples stored in the capture buffer of selected channel.
@@ -422,14 +495,24 @@ class IIOAcmeCape(object):
                   "samples" (int or float): scaled samples.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].read_capture_buffer(channel)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to read capture buffer (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+        return self._call_probe(slot, IIOAcmeProbe.read_capture_buffer,
+                                "Failed to read capture buffer",
+                                channel)
+
+    def read_capture_buffers(self, slot, out=None):
+        """ Return the samples stored in the capture buffer of all enabled
+            channels, demultiplexed in a single pass over the buffer.
+            Take care of data scaling too.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+            out (dict): optional user storage where to save samples
+                        (see IIOAcmeProbe.read_capture_buffers())
+
+        Returns:
+            dict: a dictionary holding the scaled data of each enabled
+                  channel (key: channel), as returned by read_capture_buffer().
+
+        """
+        return self._call_probe(slot, IIOAcmeProbe.read_capture_buffers,
+                                "Failed to read capture buffers", out)
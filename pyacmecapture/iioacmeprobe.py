@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Baylibre's ACME Probe Abstraction class.
 
 Baylibre's ACME Probe Abstraction class.
@@ -10,9 +10,9 @@ and the work done on "pyacmegraph" tool done by:
 """
 
 
-from __future__ import print_function
-import struct
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
 import numpy as np
 import iio
 from mltrace import MLTrace
@@ -31,21 +31,16 @@ __version__ = "0.2"
 __deprecated__ = False
 
 
-# Channels mapping: 'explicit naming' vs 'IIO channel IDs'
-CHANNEL_DICT = {
-    'Vshunt' : 'voltage0',
-    'Vbat' : 'voltage1',
-    'Time' : 'timestamp',
-    'Ishunt' : 'current3',
-    'Power' : 'power2'}
+# Channel details: IIO channel ID, unit, raw samples format
+ChannelInfo = namedtuple('ChannelInfo', ['iio_id', 'unit', 'dtype'])
 
-# Channels unit
-CHANNEL_UNITS = {
-    'Vshunt' : 'mV',
-    'Vbat' : 'mV',
-    'Time' : 'ns',
-    'Ishunt' : 'mA',
-    'Power' : 'mW'}
+# Channels mapping: 'explicit naming' vs channel details
+CHANNELS = {
+    'Vshunt' : ChannelInfo('voltage0', 'mV', np.int16),
+    'Vbat' : ChannelInfo('voltage1', 'mV', np.int16),
+    'Time' : ChannelInfo('timestamp', 'ns', np.int64),
+    'Ishunt' : ChannelInfo('current3', 'mA', np.int16),
+    'Power' : ChannelInfo('power2', 'mW', np.int16)}
 
 
 class IIOAcmeProbe(object):
@@ -55,6 +50,12 @@ class IIOAcmeProbe(object):
     controlling it as an IIO device.
 
     """
+    # No per-instance dictionary: many probes may be instantiated
+    __slots__ = ('_slot', '_type', '_shunt', '_pwr_switch',
+                 '_iio_device', '_iio_buffer', '_iio_channels', '_channels',
+                 '_scales', '_out', '_sample_dtype',
+                 '_refill_executor', '_refill_future', '_trace')
+
     def __init__(self, slot, probe_type, shunt, pwr_switch, iio_device,
                  verbose_level):
         """ Initialise IIOAcmeProbe class
@@ -79,6 +80,19 @@ class IIOAcmeProbe(object):
         self._pwr_switch = pwr_switch
         self._iio_device = iio_device
         self._iio_buffer = None
+        # All channels IIO handles (None if not found), per channel name
+        self._iio_channels = {}
+        # Enabled channels IIO handles, per channel name
+        self._channels = {}
+        # Channels scale, per channel name
+        self._scales = {}
+        # Scaled samples output buffers (per channel name), reused across reads
+        self._out = {}
+        # Layout of one (interleaved) sample in the capture buffer
+        self._sample_dtype = None
+        # Background buffer refill (single persistent worker, pending refill)
+        self._refill_executor = ThreadPoolExecutor(max_workers=1)
+        self._refill_future = None
         self._trace = MLTrace(
             verbose_level, "Probe " + self._type + " Slot " + str(self._slot))
 
@@ -86,8 +100,32 @@ class IIOAcmeProbe(object):
         self._trace.trace(2, "Slot: " + str(self._slot) + " Type: " + self._type
                           + ", Shunt: " + str(self._shunt) + " uOhm" +
                           ", Power Switch: " + str(self._pwr_switch))
-        if verbose_level >= 2:
+        if self._trace.is_enabled(3):
             self._show_iio_device_attributes()
+        self._find_channels()
+
+    def _find_channels(self):
+        """ Retrieve the IIO channel and the scale of all channels at once,
+            so that no IIO lookup is needed afterwards.
+            Private function, not to be used outside of the module.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        for channel, info in CHANNELS.items():
+            iio_ch = self._iio_device.find_channel(info.iio_id)
+            self._iio_channels[channel] = iio_ch
+            if iio_ch is not None and 'scale' in iio_ch.attrs:
+                self._scales[channel] = float(iio_ch.attrs['scale'].value)
+            else:
+                # No scale attribute (e.g. on 'timestamp' channel)
+                self._scales[channel] = 1.0
+            self._trace.trace(2, "Channel %s scale: %f",
+                              channel, self._scales[channel])
 
     def _show_iio_device_attributes(self):
         """ Print the attributes of the probe's IIO device.
@@ -100,36 +138,39 @@ class IIOAcmeProbe(object):
             None
 
         """
+        if not self._trace.is_enabled(3):
+            # Dump would be discarded: skip the attribute reads
+            return
         self._trace.trace(3, "======== IIO Device infos ========")
         self._trace.trace(3, "  ID: " +  self._iio_device.id)
         self._trace.trace(3, "  Name: " +  self._iio_device.name)
         if  self._iio_device is iio.Trigger:
             self._trace.trace(
-                3, "  Trigger: yes (rate: %u Hz)" %  self._iio_device.frequency)
+                3, "  Trigger: yes (rate: %u Hz)", self._iio_device.frequency)
         else:
             self._trace.trace(3, "  Trigger: none")
         self._trace.trace(
-            3, "  Device attributes found: %u" % len(self._iio_device.attrs))
+            3, "  Device attributes found: %u", len(self._iio_device.attrs))
         for attr in  self._iio_device.attrs:
             self._trace.trace(
                 3, "    " + attr + ": " +  self._iio_device.attrs[attr].value)
-        self._trace.trace(3, "  Device debug attributes found: %u" % len(
+        self._trace.trace(3, "  Device debug attributes found: %u", len(
             self._iio_device.debug_attrs))
         for attr in  self._iio_device.debug_attrs:
             self._trace.trace(
                 3, "    " + attr + ": " +  self._iio_device.debug_attrs[attr].value)
-        self._trace.trace(3, "  Device channels found: %u" % len(
+        self._trace.trace(3, "  Device channels found: %u", len(
             self._iio_device.channels))
         for chn in  self._iio_device.channels:
-            self._trace.trace(3, "    Channel ID: %s" % chn.id)
+            self._trace.trace(3, "    Channel ID: %s", chn.id)
             if chn.name is None:
                 self._trace.trace(3, "    Channel name: (none)")
             else:
-                self._trace.trace(3, "    Channel name: %s" % chn.name)
-            self._trace.trace(3, "    Channel direction: %s" % (
-                "output" if chn.output else 'input'))
+                self._trace.trace(3, "    Channel name: %s", chn.name)
+            self._trace.trace(3, "    Channel direction: %s",
+                              "output" if chn.output else 'input')
             self._trace.trace(
-                3, "    Channel attributes found: %u" % len(chn.attrs))
+                3, "    Channel attributes found: %u", len(chn.attrs))
             for attr in chn.attrs:
                 self._trace.trace(
                     3, "      " + attr + ": " + chn.attrs[attr].value)
@@ -225,12 +266,12 @@ class IIOAcmeProbe(object):
         try:
             self._iio_device.attrs["in_oversampling_ratio"].value = str(
                 oversampling_ratio)
-            self._trace.trace(1, "Oversampling ratio configured to %u." % (
-                oversampling_ratio))
+            self._trace.trace(1, "Oversampling ratio configured to %u.",
+                              oversampling_ratio)
             return True
         except:
             self._trace.trace(1,
-                              "Failed to configure oversampling ratio (%u)!" %
+                              "Failed to configure oversampling ratio (%u)!",
                               oversampling_ratio)
             self._trace.trace(2, traceback.format_exc())
             return False
@@ -272,7 +313,7 @@ class IIOAcmeProbe(object):
         """
         try:
             freq = self._iio_device.attrs['in_sampling_frequency'].value
-            self._trace.trace(1, "Sampling frequency: %sHz" % freq)
+            self._trace.trace(1, "Sampling frequency: %sHz", freq)
             return int(freq)
         except:
             self._trace.trace(1, "Failed to retrieve sampling frequency!")
@@ -293,14 +334,149 @@ class IIOAcmeProbe(object):
         """
         self._iio_buffer = iio.Buffer(self._iio_device, samples_count, cyclic)
         if self._iio_buffer != None:
-            self._trace.trace(1, "Buffer (count=%d, cyclic=%s) allocated." % (
-                samples_count, cyclic))
+            self._trace.trace(1, "Buffer (count=%d, cyclic=%s) allocated.",
+                              samples_count, cyclic)
+            self._configure_sample_layout()
+            self._allocate_output_buffers(samples_count)
             return True
         self._trace.trace(1,
-                          "Failed to allocate buffer! (count=%d, cyclic=%s)" % (
-                              samples_count, cyclic))
+                          "Failed to allocate buffer! (count=%d, cyclic=%s)",
+                          samples_count, cyclic)
         return False
 
+    def _get_raw_format(self, iio_ch):
+        """ Return the format of channel samples in the capture buffer, if
+            they can be used as is (no conversion to host format needed).
+            Private function, not to be used outside of the module.
+
+        Args:
+            iio_ch (iio.Channel): IIO channel
+
+        Returns:
+            numpy.dtype: raw samples format, None if samples need conversion
+                         (shifted, not full-width or repeated samples) or
+                         if the format is not reported.
+
+        """
+        try:
+            fmt = iio_ch.data_format
+            if (fmt.shift != 0 or fmt.bits != fmt.length or
+                    fmt.length not in (8, 16, 32, 64) or
+                    getattr(fmt, 'repeat', 1) != 1):
+                return None
+            return np.dtype("%s%s%u" % ('>' if fmt.is_be else '<',
+                                        'i' if fmt.is_signed else 'u',
+                                        fmt.length // 8))
+        except AttributeError:
+            return None
+
+    def _configure_sample_layout(self):
+        """ Describe the layout of one sample in the capture buffer, so that
+            all enabled channels can be demultiplexed in a single pass.
+            Layout is built from the data format reported by each channel.
+            If a channel needs conversion to host format, or if the layout
+            does not match the device sample size, no layout is set and
+            channels are read one by one (converted by libiio).
+            Private function, not to be used outside of the module.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        self._sample_dtype = None
+        # IIO interleaves the enabled channels in the buffer, ordered by
+        # scan index, each element being naturally aligned.
+        names = []
+        formats = []
+        offsets = []
+        offset = 0
+        itemsize = 1
+        try:
+            channels = sorted(self._channels.items(),
+                              key=lambda item: item[1].index)
+            indexes = [iio_ch.index for _, iio_ch in channels]
+            if len(set(indexes)) != len(indexes) or min(indexes) < 0:
+                self._trace.trace(1, "Unexpected channels scan indexes: %s",
+                                  indexes)
+                return
+            for channel, iio_ch in channels:
+                fmt = self._get_raw_format(iio_ch)
+                if fmt is None:
+                    self._trace.trace(1, "Channel %s needs conversion.",
+                                      channel)
+                    return
+                offset = -(-offset // fmt.itemsize) * fmt.itemsize
+                names.append(channel)
+                formats.append(fmt)
+                offsets.append(offset)
+                offset += fmt.itemsize
+                itemsize = max(itemsize, fmt.itemsize)
+            itemsize = -(-offset // itemsize) * itemsize
+            sample_size = self._iio_device.sample_size
+        except (AttributeError, OSError, TypeError, ValueError):
+            self._trace.trace(1, "Failed to retrieve sample layout!")
+            if self._trace.is_enabled(2):
+                self._trace.trace(2, traceback.format_exc())
+            return
+        if itemsize != sample_size:
+            self._trace.trace(1, "Sample size mismatch (%u vs %u bytes)!",
+                              itemsize, sample_size)
+            return
+        self._sample_dtype = np.dtype({'names': names, 'formats': formats,
+                                       'offsets': offsets,
+                                       'itemsize': itemsize})
+        self._trace.trace(2, "Sample layout: %s", self._sample_dtype)
+
+    def _allocate_output_buffers(self, samples_count):
+        """ Allocate the buffers receiving the scaled samples of each enabled
+            channel, so that no memory is allocated while capturing.
+            Private function, not to be used outside of the module.
+
+        Args:
+            samples_count (int): amount of samples to hold in buffer (> 0).
+
+        Returns:
+            None
+
+        """
+        self._out = {}
+        for channel in self._channels:
+            if self._scales[channel] != 1.0:
+                # Single precision is plenty for 16-bit ADC samples
+                # (and half the bytes of float64)
+                dtype = np.float32
+            else:
+                dtype = CHANNELS[channel].dtype
+            self._out[channel] = np.empty(samples_count, dtype=dtype)
+
+    def _scale_samples(self, channel, values, out=None):
+        """ Scale samples of selected channel into its output buffer.
+            Private function, not to be used outside of the module.
+
+        Args:
+            channel (string): capture channel
+            values (array): raw samples
+            out (array): output buffer (channel output buffer if None)
+
+        Returns:
+            array: scaled samples (view of the output buffer)
+
+        """
+        if out is None:
+            out = self._out[channel]
+        scaled_values = out[:len(values)]
+        scale = self._scales[channel]
+        if scale != 1.0:
+            # Scale and convert in one pass
+            np.multiply(values, np.float32(scale), out=scaled_values,
+                        casting='unsafe')
+        else:
+            scaled_values[...] = values
+        return scaled_values
+
     def enable_capture_channel(self, channel, enable):
         """ Enable/disable capture of selected channel.
 
@@ -313,29 +489,32 @@ class IIOAcmeProbe(object):
 
         """
         try:
-            iio_ch = self._iio_device.find_channel(CHANNEL_DICT[channel])
+            iio_ch_id = CHANNELS[channel].iio_id
+            iio_ch = self._iio_channels[channel]
             if not iio_ch:
-                self._trace.trace(1, "Channel %s (%s) not found!" % (
-                    channel, CHANNEL_DICT[channel]))
+                self._trace.trace(1, "Channel %s (%s) not found!",
+                                  channel, iio_ch_id)
                 return False
-            self._trace.trace(2, "Channel %s (%s) found." % (
-                channel, CHANNEL_DICT[channel]))
+            self._trace.trace(2, "Channel %s (%s) found.", channel, iio_ch_id)
             if enable is True:
                 iio_ch.enabled = True
-                self._trace.trace(1, "Channel %s (%s) capture enabled." % (
-                    channel, CHANNEL_DICT[channel]))
+                self._channels[channel] = iio_ch
+                self._trace.trace(1, "Channel %s (%s) capture enabled.",
+                                  channel, iio_ch_id)
             else:
                 iio_ch.enabled = False
-                self._trace.trace(1, "Channel %s (%s) capture disabled." % (
-                    channel, CHANNEL_DICT[channel]))
-        except:
+                self._channels.pop(channel, None)
+                self._trace.trace(1, "Channel %s (%s) capture disabled.",
+                                  channel, iio_ch_id)
+        except (KeyError, OSError):
             if enable is True:
                 self._trace.trace(1,
-                                  "Failed to enable capture on channel %s (%s)!")
+                                  "Failed to enable capture on channel %s!", channel)
             else:
                 self._trace.trace(1,
-                                  "Failed to disable capture on channel %s (%s)!")
-            self._trace.trace(2, traceback.format_exc())
+                                  "Failed to disable capture on channel %s!", channel)
+            if self._trace.is_enabled(2):
+                self._trace.trace(2, traceback.format_exc())
             return False
         return True
 
@@ -351,61 +530,139 @@ class IIOAcmeProbe(object):
         """
         try:
             self._iio_buffer.refill()
-        except:
+        except (AttributeError, OSError):
             self._trace.trace(1, "Failed to refill buffer!")
-            self._trace.trace(2, traceback.format_exc())
+            if self._trace.is_enabled(2):
+                self._trace.trace(2, traceback.format_exc())
             return False
         self._trace.trace(1, "Buffer refilled.")
         return True
 
+    def submit_refill_capture_buffer(self):
+        """ Start filling capture buffer with new samples, in background.
+            Allow processing previously read samples meanwhile.
+            Call wait_refill_capture_buffer() to wait for completion.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if operation is successful, False otherwise.
+
+        """
+        if self._refill_future is not None:
+            self._trace.trace(1, "Buffer refill already in progress!")
+            return False
+        self._refill_future = self._refill_executor.submit(
+            self.refill_capture_buffer)
+        return True
+
+    def wait_refill_capture_buffer(self):
+        """ Wait for the refill started by submit_refill_capture_buffer()
+            to complete.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if buffer was successfully refilled, False otherwise.
+
+        """
+        if self._refill_future is None:
+            self._trace.trace(1, "No buffer refill in progress!")
+            return False
+        future = self._refill_future
+        self._refill_future = None
+        return future.result()
+
     def read_capture_buffer(self, channel):
         """ Return the samples stored in the capture buffer of selected channel.
             Take care of data scaling too.
 
         Args:
-            channel (string): capture channel
+            channel (string): capture channel (enabled)
 
         Returns:
             dict: a dictionary holding the scaled data, with the following keys:
                   "channel" (string): channel,
                   "unit" (string): data unit,
                   "samples" (int or float): scaled samples.
+                  Samples are stored in a buffer reused by the next read,
+                  copy them to keep them.
 
         """
         try:
-            # Retrieve channel
-            iio_ch = self._iio_device.find_channel(CHANNEL_DICT[channel])
+            info = CHANNELS[channel]
+            # Retrieve channel and its scale (cached when enabled)
+            iio_ch = self._channels[channel]
+            scale = self._scales[channel]
             # Retrieve samples (raw)
             ch_buf_raw = iio_ch.read(self._iio_buffer)
-            if CHANNEL_DICT[channel] != 'timestamp':
-                # Retrieve channel scale
-                scale = float(iio_ch.attrs['scale'].value)
-                # Configure binary data format to unpack (16-bit signed integer)
-                unpack_str = 'h' * (len(ch_buf_raw) / struct.calcsize('h'))
-            else:
-                # No scale attribute on 'timestamp' channel
-                scale = 1.0
-                # Configure binary data format to unpack (64-bit signed integer)
-                unpack_str = 'q' * (len(ch_buf_raw) / struct.calcsize('q'))
-            # Unpack data
-            values = struct.unpack(unpack_str, ch_buf_raw)
-            self._trace.trace(
-                2, "Channel %s: %u samples read." % (channel, len(values)))
+            # Map raw data (no copy, read-only view)
+            values = np.frombuffer(ch_buf_raw, dtype=info.dtype)
             self._trace.trace(
-                3, "Channel %s samples       : %s" % (channel, str(values)))
+                2, "Channel %s: %u samples read.", channel, len(values))
+            if self._trace.is_enabled(3):
+                self._trace.trace(
+                    3, "Channel %s samples       : %s", channel, values)
             # Scale values
-            self._trace.trace(3, "Scale: %f" % scale)
-            if scale != 1.0:
-                scaled_values = np.asarray(values) * scale
-            else:
-                scaled_values = np.asarray(values)
-            self._trace.trace(
-                3,
-                "Channel %s scaled samples: %s" % (channel, str(scaled_values)))
-        except:
-            self._trace.trace(1, "Failed to read channel %s buffer!" % channel)
-            self._trace.trace(2, traceback.format_exc())
+            self._trace.trace(3, "Scale: %f", scale)
+            scaled_values = self._scale_samples(channel, values)
+            if self._trace.is_enabled(3):
+                self._trace.trace(
+                    3,
+                    "Channel %s scaled samples: %s", channel, scaled_values)
+        except (AttributeError, KeyError, OSError, ValueError):
+            self._trace.trace(1, "Failed to read channel %s buffer!", channel)
+            if self._trace.is_enabled(2):
+                self._trace.trace(2, traceback.format_exc())
             return None
         return {"channel": channel,
-                "unit": CHANNEL_UNITS[channel],
+                "unit": info.unit,
                 "samples": scaled_values}
+
+    def read_capture_buffers(self, out=None):
+        """ Return the samples stored in the capture buffer of all enabled
+            channels, demultiplexed in a single pass over the buffer.
+            Take care of data scaling too.
+
+        Args:
+            out (dict): optional user storage where to save samples of each
+                        enabled channel (key: channel, data: array of at
+                        least buffer size samples)
+
+        Returns:
+            dict: a dictionary holding the scaled data of each enabled
+                  channel (key: channel), as returned by read_capture_buffer().
+                  Samples are views of 'out' storage if provided.
+                  Otherwise, they are stored in buffers reused by the next
+                  read, copy them to keep them.
+                  None in case of error.
+
+        """
+        try:
+            if self._sample_dtype is None:
+                # Unknown layout: read (and convert) channels one by one
+                samples = {
+                    channel: np.frombuffer(iio_ch.read(self._iio_buffer),
+                                           dtype=CHANNELS[channel].dtype)
+                    for channel, iio_ch in self._channels.items()}
+            else:
+                # Retrieve all samples (raw, interleaved) at once
+                samples = np.frombuffer(self._iio_buffer.read(),
+                                        dtype=self._sample_dtype)
+                self._trace.trace(2, "%u samples read.", len(samples))
+            buffs = {}
+            for channel in self._channels:
+                buffs[channel] = {
+                    "channel": channel,
+                    "unit": CHANNELS[channel].unit,
+                    "samples": self._scale_samples(
+                        channel, samples[channel],
+                        out[channel] if out is not None else None)}
+        except (AttributeError, KeyError, OSError, ValueError):
+            self._trace.trace(1, "Failed to read buffer!")
+            if self._trace.is_enabled(2):
+                self._trace.trace(2, traceback.format_exc())
+            return None
+        return buffs
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Baylibre's ACME Cape Simulation class.
 
 Simulate Baylibre's ACME Cape, for debug purposes only.
@@ -10,8 +10,9 @@ Todo:
 
 """
 
-from __future__ import print_function
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from mltrace import MLTrace
 
 
@@ -62,6 +63,12 @@ class IIOFakeAcmeCape(object):
         self._channels = []
         self._samples_count = 0
         self._time_start = 0
+        # Constant samples (per slot), generated once
+        self._vbat_samples = {}
+        self._samples = {}
+        # Background buffer refill workers and pending refills (per slot)
+        self._refill_executors = {}
+        self._refill_futures = {}
 
     def is_up(self):
         """ Check if the ACME cape is up and running.
@@ -85,7 +92,7 @@ class IIOFakeAcmeCape(object):
             int: number of slots available on the cape (> 0).
 
         """
-        self._trace.trace(1, "Slot count: %u" % self._slots_count)
+        self._trace.trace(1, "Slot count: %u", self._slots_count)
         return self._slots_count
 
     def _find_probes(self):
@@ -124,7 +131,7 @@ class IIOFakeAcmeCape(object):
             bool: True if a probe is attached to selected slot, False otherwise.
 
         """
-        self._trace.trace(1, "Slot %d populated." % slot)
+        self._trace.trace(1, "Slot %d populated.", slot)
         return True
 
     def enable_capture_channel(self, slot, channel, enable):
@@ -145,7 +152,7 @@ class IIOFakeAcmeCape(object):
             if channel in self._channels:
                 self._channels.remove(channel)
         self._trace.trace(
-            1, "Slot %d enabled channels: %s" % (slot, self._channels))
+            1, "Slot %d enabled channels: %s", slot, self._channels)
         return True
 
     def set_oversampling_ratio(self, slot, oversampling_ratio):
@@ -215,6 +222,13 @@ class IIOFakeAcmeCape(object):
 
         """
         self._samples_count = samples_count
+        # Samples never change, generate them once (read-only)
+        self._vbat_samples[slot] = np.full(samples_count, 1000 * float(slot),
+                                           dtype=np.float32)
+        self._vbat_samples[slot].setflags(write=False)
+        self._samples[slot] = np.full(samples_count, float(slot),
+                                      dtype=np.float32)
+        self._samples[slot].setflags(write=False)
         return True
 
     def refill_capture_buffer(self, slot):
@@ -230,6 +244,40 @@ class IIOFakeAcmeCape(object):
         sleep(0.5)
         return True
 
+    def submit_refill_capture_buffer(self, slot):
+        """ Start filling capture buffer with new samples, in background.
+            Call wait_refill_capture_buffer() to wait for completion.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+
+        Returns:
+            bool: True if operation is successful, False otherwise.
+
+        """
+        if slot in self._refill_futures:
+            return False
+        if slot not in self._refill_executors:
+            self._refill_executors[slot] = ThreadPoolExecutor(max_workers=1)
+        self._refill_futures[slot] = self._refill_executors[slot].submit(
+            self.refill_capture_buffer, slot)
+        return True
+
+    def wait_refill_capture_buffer(self, slot):
+        """ Wait for the refill started by submit_refill_capture_buffer()
+            to complete.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+
+        Returns:
+            bool: True if buffer was successfully refilled, False otherwise.
+
+        """
+        if slot not in self._refill_futures:
+            return False
+        return self._refill_futures.pop(slot).result()
+
     def read_capture_buffer(self, slot, channel):
         """ Return the samples stored in the capture buffer of selected channel.
             Take care of data scaling too.
@@ -248,17 +296,42 @@ class IIOFakeAcmeCape(object):
         if channel == "Time":
             buff = {"channel": channel,
                     "unit": CHANNEL_UNITS[channel],
-                    "samples": range(self._time_start,
-                                     self._time_start +
-                                     (1000000 * self._samples_count),
-                                     1000000)}
+                    "samples": np.arange(self._time_start,
+                                         self._time_start +
+                                         (1000000 * self._samples_count),
+                                         1000000, dtype=np.int64)}
             self._time_start += 1000000 * self._samples_count
         elif channel == "Vbat":
             buff = {"channel": channel,
                     "unit": CHANNEL_UNITS[channel],
-                    "samples": [1000 * float(slot)] * self._samples_count}
+                    "samples": self._vbat_samples[slot]}
         else:
             buff = {"channel": channel,
                     "unit": CHANNEL_UNITS[channel],
-                    "samples": [float(slot)] * self._samples_count}
+                    "samples": self._samples[slot]}
         return buff
+
+    def read_capture_buffers(self, slot, out=None):
+        """ Return the samples stored in the capture buffer of all enabled
+            channels, demultiplexed in a single pass over the buffer.
+            Take care of data scaling too.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+            out (dict): optional user storage where to save samples
+                        (key: channel, data: array of at least buffer size
+                        samples)
+
+        Returns:
+            dict: a dictionary holding the scaled data of each enabled
+                  channel (key: channel), as returned by read_capture_buffer().
+
+        """
+        buffs = {}
+        for channel in set(self._channels):
+            buffs[channel] = self.read_capture_buffer(slot, channel)
+            if out is not None:
+                samples = out[channel][:len(buffs[channel]["samples"])]
+                samples[...] = buffs[channel]["samples"]
+                buffs[channel]["samples"] = samples
+        return buffs
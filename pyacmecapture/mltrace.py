@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Multi-Level Trace Python Class
 
 Implement a smart trace with configurable header and debug trace levels.
@@ -32,16 +32,30 @@ class MLTrace():
         self._verbose_level = verbose_level
         self._msg_header = msg_header
 
-    def trace(self, level, msg):
+    def is_enabled(self, level):
+        """Return True if messages of selected debug level are printed.
+
+        Useful to skip building expensive messages that would be ignored.
+
+        Args:
+            level: selected debug level (e.g. 1, 2, 3, ...)
+        """
+        return self._verbose_level >= level
+
+    def trace(self, level, msg, *args):
         """Print debug messages depending on selected debug level.
 
         If 'level' <= self.verbose_level, then 'msg' is printed, ignored otherwise.
+        'msg' is only formatted with 'args' when printed.
 
         Args:
             level: selected debug level (e.g. 1, 2, 3, ...)
             msg: a custom message (e.g. 'this is my great custom message')
+            args: optional arguments merged into 'msg' using '%' operator
         """
         if (self._verbose_level >= level):
+            if args:
+                msg = msg % args
             if self._msg_header != None:
                 print("[" + self._msg_header + "] " + msg)
             else:
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Python ACME Power Capture Utility
 
 This utility is designed to capture voltage, current and power samples with
@@ -25,18 +25,18 @@ Todo:
 """
 
 
-from __future__ import print_function
 import traceback
+import re
 import sys
 import os
+import errno
 import argparse
 import threading
-from time import time, localtime, strftime
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic_ns, localtime, strftime
 from colorama import init, Fore, Style
 import numpy as np
 from mltrace import MLTrace
-from iioacmecape import IIOAcmeCape
-from iiofakeacmecape import IIOFakeAcmeCape
 
 __app_name__ = "Python ACME Power Capture Utility"
 __license__ = "MIT"
@@ -57,6 +57,9 @@ _CAPTURED_CHANNELS = ["Time", "Vbat", "Ishunt"]
 _REPORT_1ST_COL_WIDTH = 13
 _REPORT_COLS_WIDTH_MIN = 7
 _REPORT_COL_PAD = 2
+_REPORT_TITLE = " Power Measurement Report "
+_STATS_BLOCK_SIZE = 65536
+_SLOTS_RE = re.compile(r"^\s*\d+\s*(?:,\s*\d+\s*)*$")
 
 def log(color, flag, msg):
     """ Format messages as follow: "['color'ed 'flag'] 'msg'"
@@ -95,6 +98,49 @@ def exit_with_error(err):
     exit(err)
 
 
+def parse_slots(slots, max_slot):
+    """ Parse a list of ACME slots given as a comma-separated string.
+
+    Args:
+        slots (str): comma-separated list of slots (e.g. '1,2,4,7'),
+                     whitespace around slots is ignored
+        max_slot (int): highest valid slot
+
+    Returns:
+        list of int: slots, None if list is not valid
+
+    """
+    if _SLOTS_RE.match(slots) is None:
+        return None
+    slots = [int(slot) for slot in slots.split(',')]
+    if min(slots) < 1 or max(slots) > max_slot:
+        return None
+    return slots
+
+
+def min_max_avg(samples):
+    """ Compute min, max and average values of samples in a single pass.
+        Samples are processed block by block, so that each block is fetched
+        from memory once and stays in cache for the 3 reductions.
+
+    Args:
+        samples (array): samples (not empty)
+
+    Returns:
+        tuple: (min, max, avg) values of samples
+
+    """
+    mins = []
+    maxs = []
+    total = 0.0
+    for start in range(0, len(samples), _STATS_BLOCK_SIZE):
+        block = samples[start:start + _STATS_BLOCK_SIZE]
+        mins.append(block.min())
+        maxs.append(block.max())
+        total += block.sum(dtype=np.float64)
+    return min(mins), max(maxs), total / len(samples)
+
+
 class IIODeviceCaptureThread(threading.Thread):
     """ IIO ACME Capture thread
 
@@ -126,18 +172,32 @@ class IIODeviceCaptureThread(threading.Thread):
         self._duration = duration
         self._timestamp_thread_start = None
         self._thread_execution_time = None
+        self._expected_refills_count = None
+        self._expected_samples_count = None
         self._refill_start_times = None
         self._refill_end_times = None
         self._read_start_times = None
         self._read_end_times = None
         self._failed = None
         self._samples = None
+        # Samples storage: timestamps, and other channels (one row each)
+        # with an extra row reserved for Power computed after capture
+        self._timestamps = None
+        self._data = None
+        self._ch_index = {}
+        for ch in self._channels:
+            if ch != "Time":
+                self._ch_index[ch] = len(self._ch_index)
+        self._power_row = len(self._ch_index)
+        self._storage = None
+        self._units = None
+        self._samples_count = None
         self._verbose_level = verbose_level
         self._trace = MLTrace(verbose_level, "Thread Slot %u" % self._slot)
         self._trace.trace(
             2,
-            "Thread params: slot=%u channels=%s buffer size=%u duration=%us" % (
-                self._slot, self._channels, self._bufsize, self._duration))
+            "Thread params: slot=%u channels=%s buffer size=%u duration=%us",
+            self._slot, self._channels, self._bufsize, self._duration)
 
     def configure_capture(self):
         """ Configure capture parameters (enable channel(s),
@@ -166,18 +226,129 @@ class IIODeviceCaptureThread(threading.Thread):
         for ch in self._channels:
             ret = self._cape.enable_capture_channel(self._slot, ch, True)
             if ret is False:
-                self._trace.trace(1, "Failed to enable %s capture!" % ch)
+                self._trace.trace(1, "Failed to enable %s capture!", ch)
                 return False
             else:
-                self._trace.trace(1, "%s capture enabled." % ch)
+                self._trace.trace(1, "%s capture enabled.", ch)
 
         # Allocate capture buffer
         if self._cape.allocate_capture_buffer(self._slot, self._bufsize) is False:
             self._trace.trace(1, "Failed to allocate capture buffer!")
             return False
         self._trace.trace(1, "Capture buffer allocated.")
+
+        # Estimate amount of samples to be captured (to preallocate storage)
+        freq = self._cape.get_sampling_frequency(self._slot)
+        if freq:
+            refills = int(self._duration * freq) // self._bufsize + 2
+        else:
+            refills = 1
+        self._expected_refills_count = refills
+        self._expected_samples_count = refills * self._bufsize
+        self._trace.trace(
+            1, "Expected samples count: %u", self._expected_samples_count)
         return True
 
+    def get_samples_storage_shape(self):
+        """ Return the shape of the samples storage needed for the capture.
+            To be called once capture is configured.
+
+        Args:
+            None
+
+        Returns:
+            tuple: (rows, samples): rows of samples storage (one per channel,
+                   except timestamps) and expected samples count
+
+        """
+        return (self._power_row + 1, self._expected_samples_count)
+
+    def set_samples_storage(self, data, timestamps):
+        """ Provide preallocated samples storage, used instead of allocating
+            it at first read (it is still grown if needed).
+
+        Args:
+            data (array): 2-D array, with shape as returned by
+                          get_samples_storage_shape()
+            timestamps (array): 1-D int64 array (expected samples count long)
+
+        Returns:
+            None
+
+        """
+        self._storage = (data, timestamps)
+
+    def _allocate_storage(self, buffs):
+        """ Allocate samples storage, using format of first samples read, and
+            copy these first samples into it.
+            Timestamps are saved in their own array, other channels in rows of
+            a single 2-D array (one contiguous row per channel, plus one
+            reserved for Power).
+
+        Args:
+            buffs (dict): samples read, as returned by read_capture_buffers()
+
+        Returns:
+            None
+
+        """
+        count = len(buffs[self._channels[0]]["samples"])
+        if self._storage is not None and count <= self._storage[0].shape[1]:
+            # Use storage preallocated by caller
+            self._data, self._timestamps = self._storage
+            if "Time" not in buffs:
+                self._timestamps = None
+        else:
+            # Preallocate storage for the whole capture
+            capacity = max(self._expected_samples_count, count)
+            dtypes = [buffs[ch]["samples"].dtype for ch in self._ch_index]
+            self._data = np.empty(
+                (self._power_row + 1, capacity),
+                dtype=np.result_type(*dtypes) if dtypes else np.float32)
+            if "Time" in buffs:
+                self._timestamps = np.empty(
+                    capacity, dtype=buffs["Time"]["samples"].dtype)
+        for ch in self._channels:
+            self._units[ch] = buffs[ch]["unit"]
+        # Read buffers are reused by the next read, copy samples
+        for ch, idx in self._ch_index.items():
+            self._data[idx, :count] = buffs[ch]["samples"]
+        if self._timestamps is not None:
+            self._timestamps[:count] = buffs["Time"]["samples"]
+        self._samples_count = count
+
+    def _next_samples_storage(self):
+        """ Return storage where to read next samples (one view per channel),
+            growing samples storage geometrically when full.
+
+        Args:
+            None
+
+        Returns:
+            dict: a dictionary holding an array of (at least) buffer size
+                  samples for each channel (key: channel)
+
+        """
+        start = self._samples_count
+        end = start + self._bufsize
+        if end > self._data.shape[1]:
+            # Storage full: grow it geometrically
+            capacity = max(2 * self._data.shape[1], end)
+            data = np.empty((self._power_row + 1, capacity),
+                            dtype=self._data.dtype)
+            data[:, :start] = self._data[:, :start]
+            self._data = data
+            if self._timestamps is not None:
+                timestamps = np.empty(capacity, dtype=self._timestamps.dtype)
+                timestamps[:start] = self._timestamps[:start]
+                self._timestamps = timestamps
+        storage = {}
+        for ch, idx in self._ch_index.items():
+            storage[ch] = self._data[idx, start:end]
+        if self._timestamps is not None:
+            storage["Time"] = self._timestamps[start:end]
+        return storage
+
     def run(self):
         """ Capture samples for the selected duration. Save samples in a
             dictionary as described in get_samples() docstring.
@@ -191,49 +362,135 @@ class IIODeviceCaptureThread(threading.Thread):
         """
         self._failed = False
         self._samples = {}
-        self._refill_start_times = []
-        self._refill_end_times = []
-        self._read_start_times = []
-        self._read_end_times = []
+        self._data = None
+        self._timestamps = None
+        self._units = {}
+        self._samples_count = 0
+        # Timings storage (refill start/end, read start/end, in ns), one row each
+        timings = np.empty((4, self._expected_refills_count + 1), dtype=np.int64)
+        (refill_start_times, refill_end_times,
+         read_start_times, read_end_times) = timings
+        refills_count = 0
+        self._samples["slot"] = self._slot
+        self._samples["channels"] = self._channels
+        self._samples["duration"] = self._duration
         for ch in self._channels:
             self._samples[ch] = None
-            self._samples["slot"] = self._slot
-            self._samples["channels"] = self._channels
-            self._samples["duration"] = self._duration
-
-        self._timestamp_thread_start = time()
-        elapsed_time = 0
-        while elapsed_time < self._duration:
-            # Capture samples
-            self._refill_start_times.append(time())
-            ret = self._cape.refill_capture_buffer(self._slot)
-            self._refill_end_times.append(time())
+
+        self._timestamp_thread_start = monotonic_ns()
+        duration_ns = self._duration * 1000000000
+        elapsed_time_ns = 0
+        # Capture samples (buffer is refilled in background)
+        refill_start_times[0] = monotonic_ns()
+        self._cape.submit_refill_capture_buffer(self._slot)
+        while elapsed_time_ns < duration_ns:
+            # Wait for captured samples
+            ret = self._cape.wait_refill_capture_buffer(self._slot)
+            # Buffer refill end is also buffer read start
+            now = monotonic_ns()
+            refill_end_times[refills_count] = now
             if ret != True:
                 self._trace.trace(1, "Warning: error during buffer refill!")
                 self._failed = True
             # Read captured samples
-            self._read_start_times.append(time())
+            read_start_times[refills_count] = now
+            if self._data is None:
+                # Samples format not known yet: storage allocated after read
+                buffs = self._cape.read_capture_buffers(self._slot)
+            else:
+                # Read samples straight into samples storage
+                buffs = self._cape.read_capture_buffers(
+                    self._slot, self._next_samples_storage())
+            now = monotonic_ns()
+            elapsed_time_ns = now - self._timestamp_thread_start
+            if elapsed_time_ns < duration_ns:
+                if refills_count + 1 == timings.shape[1]:
+                    # More refills than expected: grow timings storage
+                    timings = np.concatenate(
+                        (timings, np.empty_like(timings)), axis=1)
+                    (refill_start_times, refill_end_times,
+                     read_start_times, read_end_times) = timings
+                # Capture next samples while processing these ones
+                refill_start_times[refills_count + 1] = now
+                self._cape.submit_refill_capture_buffer(self._slot)
+            if not buffs or None in [buffs.get(ch) for ch in self._channels]:
+                self._trace.trace(1, "Warning: error during buffer read!")
+                self._failed = True
+            else:
+                if self._data is None:
+                    self._allocate_storage(buffs)
+                else:
+                    self._samples_count += len(buffs[self._channels[0]]["samples"])
+                if self._trace.is_enabled(3):
+                    for ch in self._channels:
+                        self._trace.trace(3, "%s samples read: %s",
+                                          ch, buffs[ch]["samples"])
+            read_end_times[refills_count] = monotonic_ns()
+            refills_count += 1
+        self._thread_execution_time = \
+            (monotonic_ns() - self._timestamp_thread_start) / 1000000000.0
+        # Keep timings of completed refills only
+        (self._refill_start_times, self._refill_end_times,
+         self._read_start_times, self._read_end_times) = \
+            timings[:, :refills_count]
+        # Expose each channel samples as a view of samples storage
+        if self._data is not None:
+            count = self._samples_count
             for ch in self._channels:
-                s = self._cape.read_capture_buffer(self._slot, ch)
-                if s is None:
-                    self._trace.trace(1, "Warning: error during %s buffer read!" % ch)
-                    self._failed = True
-                if self._samples[ch] is not None:
-                    self._samples[ch]["samples"] = np.append(
-                        self._samples[ch]["samples"], s["samples"])
+                self._samples[ch] = {}
+                self._samples[ch]["failed"] = self._failed
+                self._samples[ch]["unit"] = self._units[ch]
+                if ch == "Time":
+                    self._samples[ch]["samples"] = self._timestamps[:count]
                 else:
-                    self._samples[ch] = {}
-                    self._samples[ch]["failed"] = False
-                    self._samples[ch]["unit"] = s["unit"]
-                    self._samples[ch]["samples"] = s["samples"]
-                self._trace.trace(3, "self._samples[%s] = %s" % (ch, str(self._samples[ch])))
-            self._read_end_times.append(time())
-            elapsed_time = time() - self._timestamp_thread_start
-        self._thread_execution_time = time() - self._timestamp_thread_start
-        self._samples[ch]["failed"] = self._failed
+                    self._samples[ch]["samples"] = \
+                        self._data[self._ch_index[ch], :count]
+            # Storage for Power, to be computed from captured samples
+            self._samples["Power"] = {}
+            self._samples["Power"]["unit"] = "mW" # FIXME
+            self._samples["Power"]["samples"] = \
+                self._data[self._power_row, :count]
         self._trace.trace(1, "Thread done.")
         return True
 
+    def _print_timings(self, name, start_times, end_times):
+        """ Print timings of a buffer operation (refill or read), with stats
+            on operation durations and delays between 2 operations.
+            Private function, not to be used outside of the class.
+
+        Args:
+            name (str): buffer operation name (e.g. 'Refill', 'Read')
+            start_times (array): operations start times (in ns)
+            end_times (array): operations end times (in ns)
+
+        Returns:
+            None
+
+        """
+        # Compute durations and delays on integer timings (ns),
+        # convert to ms only what is printed
+        durations = end_times - start_times
+        if self._trace.is_enabled(2):
+            # Print times relative to first one
+            first_start_time = start_times[0]
+            self._trace.trace(2, "Buffer %s start times (ms): %s", name,
+                              (start_times - first_start_time) / 1000000.0)
+            self._trace.trace(2, "Buffer %s end times (ms): %s", name,
+                              (end_times - first_start_time) / 1000000.0)
+            self._trace.trace(2, "Buffer %s duration (ms): %s", name,
+                              durations / 1000000.0)
+        if len(start_times) > 1:
+            self._trace.trace(1, "Buffer %s Duration (ms): min=%s max=%s avg=%s",
+                              name, *[value / 1000000.0
+                                      for value in min_max_avg(durations)])
+            delays = np.diff(start_times)
+            if self._trace.is_enabled(2):
+                self._trace.trace(2, "Delay between 2 Buffer %s (ms): %s",
+                                  name, delays / 1000000.0)
+            self._trace.trace(1, "Buffer %s Delay (ms): min=%s max=%s avg=%s",
+                              name, *[value / 1000000.0
+                                      for value in min_max_avg(delays)])
+
     def print_runtime_stats(self):
         """ Print various capture runtime-collected stats.
             Since printing traces from multiple threads causes mixed and
@@ -247,82 +504,15 @@ class IIODeviceCaptureThread(threading.Thread):
             None
 
         """
+        if not self._trace.is_enabled(1):
+            # Nothing would be printed, skip stats computation
+            return
         self._trace.trace(1, "------------- Thread Runtime Stats -------------")
-        self._trace.trace(1, "Thread execution time: %s" % self._thread_execution_time)
-        # Convert list to numpy array
-        self._refill_start_times = np.asarray(self._refill_start_times)
-        self._refill_end_times = np.asarray(self._refill_end_times)
-        self._read_start_times = np.asarray(self._read_start_times)
-        self._read_end_times = np.asarray(self._read_end_times)
-        # Make timestamps relative to first one, and convert to ms
-        first_refill_start_time = self._refill_start_times[0]
-        self._refill_start_times -= first_refill_start_time
-        self._refill_start_times *= 1000
-        self._refill_end_times -= first_refill_start_time
-        self._refill_end_times *= 1000
-
-        first_read_start_time = self._read_start_times[0]
-        self._read_start_times -= first_read_start_time
-        self._read_start_times *= 1000
-        self._read_end_times -= first_read_start_time
-        self._read_end_times *= 1000
-        # Compute refill and read durations
-        refill_durations = np.subtract(
-            self._refill_end_times, self._refill_start_times)
-        read_durations = np.subtract(
-            self._read_end_times, self._read_start_times)
-
-        # Print time each time buffer was getting refilled
-        self._trace.trace(2, "Buffer Refill start times (ms): %s" % self._refill_start_times)
-        self._trace.trace(2, "Buffer Refill end times (ms): %s" % self._refill_end_times)
-        # Print time spent refilling buffer
-        self._trace.trace(2, "Buffer Refill duration (ms): %s" % refill_durations)
-        if len(self._refill_start_times) > 1:
-            # Print buffer refill time stats
-            refill_durations_min = np.amin(refill_durations)
-            refill_durations_max = np.amax(refill_durations)
-            refill_durations_avg = np.average(refill_durations)
-            self._trace.trace(1, "Buffer Refill Duration (ms): min=%s max=%s avg=%s" % (
-                refill_durations_min,
-                refill_durations_max,
-                refill_durations_avg))
-            # Print delays between 2 consecutive buffer refills
-            refill_delays = np.ediff1d(self._refill_start_times)
-            self._trace.trace(2, "Delay between 2 Buffer Refill (ms): %s" % refill_delays)
-            # Print buffer refill delay stats
-            refill_delays_min = np.amin(refill_delays)
-            refill_delays_max = np.amax(refill_delays)
-            refill_delays_avg = np.average(refill_delays)
-            self._trace.trace(1, "Buffer Refill Delay (ms): min=%s max=%s avg=%s" % (
-                refill_delays_min,
-                refill_delays_max,
-                refill_delays_avg))
-
-        # Print time each time buffer was getting read
-        self._trace.trace(2, "Buffer Read start times (ms): %s" % self._read_start_times)
-        self._trace.trace(2, "Buffer Read end times (ms): %s" % self._read_end_times)
-        # Print time spent reading buffer
-        self._trace.trace(2, "Buffer Read duration (ms): %s" % read_durations)
-        if len(self._read_start_times) > 1:
-            # Print buffer read time stats
-            read_durations_min = np.amin(read_durations)
-            read_durations_max = np.amax(read_durations)
-            read_durations_avg = np.average(read_durations)
-            self._trace.trace(1, "Buffer Read Duration (ms): min=%s max=%s avg=%s" % (
-                read_durations_min,
-                read_durations_max,
-                read_durations_avg))
-            # Print delays between 2 consecutive buffer reads
-            read_delays = np.ediff1d(self._read_start_times)
-            self._trace.trace(2, "Delay between 2 Buffer Read (ms): %s" % read_delays)
-            # Print buffer read delay stats
-            read_delays_min = np.amin(read_delays)
-            read_delays_max = np.amax(read_delays)
-            read_delays_avg = np.average(read_delays)
-            self._trace.trace(1, "Buffer Read Delay (ms): min=%s max=%s avg=%s" % (
-                read_delays_min,
-                read_delays_max,
-                read_delays_avg))
+        self._trace.trace(1, "Thread execution time: %s", self._thread_execution_time)
+        self._print_timings(
+            "Refill", self._refill_start_times, self._refill_end_times)
+        self._print_timings(
+            "Read", self._read_start_times, self._read_end_times)
         self._trace.trace(1, "------------------------------------------------")
 
     def get_samples(self):
@@ -341,6 +531,8 @@ class IIODeviceCaptureThread(threading.Thread):
                     "failed" (bool): False if successful, True otherwise
                     "samples" (array): captured samples
                     "unit" (str): captured samples unit}}
+                "Power" (dict): storage for Power samples (not computed),
+                    with "samples" and "unit" key/data
             E.g:
                 {'slot': 1, 'channels': ['Vbat', 'Ishunt'], 'duration': 3,
                  'Vbat': {'failed': False, 'samples': array([ 1, 2, 3 ]), 'unit': 'mV'},
@@ -418,7 +610,7 @@ def main():
                         help='''Use a fake cape (SW-simulated,
                         no real HW access).
                         Use for development purposes only.''')
-    parser.add_argument('--verbose', '-v', action='count',
+    parser.add_argument('--verbose', '-v', action='count', default=0,
                         help='print debug traces (various levels v, vv, vvv)')
 
     args = parser.parse_args()
@@ -430,9 +622,12 @@ def main():
     err = err - 1
 
     # Create an IIOAcmeCape instance
+    # (imported here: no need to load libiio when using the fake cape)
     if args.fake is False:
+        from iioacmecape import IIOAcmeCape
         iio_acme_cape = IIOAcmeCape(args.ip, args.verbose)
     else:
+        from iiofakeacmecape import IIOFakeAcmeCape
         iio_acme_cape = IIOFakeAcmeCape(args.ip, args.verbose)
     max_rail_count = iio_acme_cape.get_slot_count()
 
@@ -444,24 +639,19 @@ def main():
         log(Fore.RED, "FAILED", "Check user argument ('count')")
         exit_with_error(err)
 
-    try:
-        if args.slots is not None:
-            args.slots = args.slots.split(',')
-            for index, item in enumerate(args.slots):
-                args.slots[index] = int(item)
-                assert args.slots[index] <= max_rail_count
-                assert args.slots[index] > 0
-            args.count = len(args.slots)
-        else:
-            args.slots = range(1, args.count + 1)
-    except:
-        log(Fore.RED, "FAILED", "Check user argument ('slots')")
-        exit_with_error(err)
+    if args.slots is not None:
+        args.slots = parse_slots(args.slots, max_rail_count)
+        if args.slots is None:
+            log(Fore.RED, "FAILED", "Check user argument ('slots')")
+            exit_with_error(err)
+        args.count = len(args.slots)
+    else:
+        args.slots = range(1, args.count + 1)
 
     try:
         if args.names is not None:
             args.names = args.names.split(',')
-            trace.trace(2, "args.names: %s" % args.names)
+            trace.trace(2, "args.names: %s", args.names)
             assert args.count == len(args.names)
     except:
         log(Fore.RED, "FAILED", "Check user argument ('names')")
@@ -477,24 +667,23 @@ def main():
 
     # Create output directory (if doesn't exist)
     now = strftime("%Y%m%d-%H%M%S", localtime())
-    if args.nofile is False:
+    nofile = args.nofile
+    trace_prefix = args.out if args.out is not None else now
+    if nofile is False:
         if args.outdir is None:
             outdir = os.path.join(os.path.expanduser('~/pyacmecapture'), now)
         else:
             outdir = args.outdir
-        trace.trace(1, "Output directory: %s" % outdir)
+        trace.trace(1, "Output directory: %s", outdir)
 
-        if args.out is None:
-            report_filename = os.path.join(outdir, now + "-report.txt")
-        else:
-            report_filename = os.path.join(outdir, args.out + "-report.txt")
-        trace.trace(1, "Report filename: %s" % report_filename)
+        report_filename = os.path.join(outdir, trace_prefix + "-report.txt")
+        trace.trace(1, "Report filename: %s", report_filename)
 
         try:
             os.makedirs(outdir)
         except OSError as e:
-            if e.errno == os.errno.EEXIST:
-                trace.trace(1, "Directory '%s' already exists." % outdir)
+            if e.errno == errno.EEXIST:
+                trace.trace(1, "Directory '%s' already exists.", outdir)
             else:
                 log(Fore.RED, "FAILED", "Create output directory")
                 trace.trace(2, traceback.format_exc())
@@ -550,6 +739,16 @@ def main():
             exit_with_error(err)
         threads.append(thread)
         log(Fore.GREEN, "OK", "Configure capture thread for probe in slot #%u" % i)
+
+    # Allocate samples storage of all capture threads at once
+    rows, capacity = np.amax(
+        [thread.get_samples_storage_shape() for thread in threads], axis=0)
+    data_pool = np.empty((len(threads), rows, capacity), dtype=np.float32)
+    timestamps_pool = np.empty((len(threads), capacity), dtype=np.int64)
+    for i, thread in enumerate(threads):
+        thread.set_samples_storage(data_pool[i], timestamps_pool[i])
+    trace.trace(1, "Samples storage allocated (%u bytes).",
+                data_pool.nbytes + timestamps_pool.nbytes)
     err = err - 1
 
     # Start capture threads
@@ -577,7 +776,8 @@ def main():
     data = []
     for thread in threads:
         samples = thread.get_samples()
-        trace.trace(3, "Slot %u captured data: %s" % (samples['slot'], samples))
+        if trace.is_enabled(3):
+            trace.trace(3, "Slot %u captured data: %s", samples['slot'], samples)
         data.append(samples)
     log(Fore.GREEN, "OK", "Retrieve captured samples")
 
@@ -588,47 +788,41 @@ def main():
         # Make time samples relative to fist sample
         first_timestamp = data[i]["Time"]["samples"][0]
         data[i]["Time"]["samples"] -= first_timestamp
-        timestamp_diffs = np.ediff1d(data[i]["Time"]["samples"])
-        timestamp_diffs_ms = timestamp_diffs / 1000000
-        trace.trace(3, "Slot %u timestamp_diffs (ms): %s" % (
-            slot, timestamp_diffs_ms))
-        timestamp_diffs_min = np.amin(timestamp_diffs_ms)
-        timestamp_diffs_max = np.amax(timestamp_diffs_ms)
-        timestamp_diffs_avg = np.average(timestamp_diffs_ms)
+        # Compute stats on integer diffs (ns), convert only results to ms
+        timestamp_diffs = np.diff(data[i]["Time"]["samples"])
+        if trace.is_enabled(3):
+            trace.trace(3, "Slot %u timestamp_diffs (ms): %s",
+                        slot, timestamp_diffs / 1000000)
+        timestamp_diffs_min, timestamp_diffs_max, timestamp_diffs_avg = [
+            value / 1000000 for value in min_max_avg(timestamp_diffs)]
         trace.trace(1, "Slot %u Time difference between 2 samples (ms): "
-                       "min=%u max=%u avg=%u" % (slot,
-                                                 timestamp_diffs_min,
-                                                 timestamp_diffs_max,
-                                                 timestamp_diffs_avg))
+                       "min=%u max=%u avg=%u", slot,
+                    timestamp_diffs_min,
+                    timestamp_diffs_max,
+                    timestamp_diffs_avg)
         real_capture_time_ms = data[i]["Time"]["samples"][-1] / 1000000
         sample_count = len(data[i]["Time"]["samples"])
         real_sampling_rate = sample_count / (real_capture_time_ms / 1000.0)
         trace.trace(1,
-                    "Slot %u: real capture duration: %u ms (%u samples)" % (
-                        slot, real_capture_time_ms, sample_count))
+                    "Slot %u: real capture duration: %u ms (%u samples)",
+                    slot, real_capture_time_ms, sample_count)
         trace.trace(1,
-                    "Slot %u: real sampling rate: %u Hz" % (
-                        slot, real_sampling_rate))
-
-        # Compute Power (P = Vbat * Ishunt)
-        data[i]["Power"] = {}
-        data[i]["Power"]["unit"] = "mW" # FIXME
-        data[i]["Power"]["samples"] = np.multiply(
-            data[i]["Vbat"]["samples"], data[i]["Ishunt"]["samples"])
-        data[i]["Power"]["samples"] /= 1000.0
-        trace.trace(3, "Slot %u power samples: %s" % (
-            slot, data[i]["Power"]["samples"]))
+                    "Slot %u: real sampling rate: %u Hz",
+                    slot, real_sampling_rate)
+
+        # Compute Power (P = Vbat * Ishunt) into storage reserved by thread
+        np.multiply(data[i]["Vbat"]["samples"], data[i]["Ishunt"]["samples"],
+                    out=data[i]["Power"]["samples"])
+        data[i]["Power"]["samples"] *= 1e-3
+        if trace.is_enabled(3):
+            trace.trace(3, "Slot %u power samples: %s",
+                        slot, data[i]["Power"]["samples"])
 
         # Compute min, max, avg values for Vbat, Ishunt and Power
-        data[i]["Vbat min"] = np.amin(data[i]["Vbat"]["samples"])
-        data[i]["Vbat max"] = np.amax(data[i]["Vbat"]["samples"])
-        data[i]["Vbat avg"] = np.average(data[i]["Vbat"]["samples"])
-        data[i]["Ishunt min"] = np.amin(data[i]["Ishunt"]["samples"])
-        data[i]["Ishunt max"] = np.amax(data[i]["Ishunt"]["samples"])
-        data[i]["Ishunt avg"] = np.average(data[i]["Ishunt"]["samples"])
-        data[i]["Power min"] = np.amin(data[i]["Power"]["samples"])
-        data[i]["Power max"] = np.amax(data[i]["Power"]["samples"])
-        data[i]["Power avg"] = np.average(data[i]["Power"]["samples"])
+        for ch in ["Vbat", "Ishunt", "Power"]:
+            (data[i][ch + " min"],
+             data[i][ch + " max"],
+             data[i][ch + " avg"]) = min_max_avg(data[i][ch]["samples"])
     log(Fore.GREEN, "OK", "Process samples")
 
     # Generate report
@@ -652,15 +846,24 @@ def main():
     table['data_keys'][' Max (mW)'] = 'Power max'
     table['data_keys'][' Avg (mW)'] = 'Power avg'
 
-    report = []
+    # First line reserved for header dashline (sized once report is complete)
+    report = [""]
+    report_max_length = 0
+
+    def add_report_line(line):
+        """ Append line to report, keeping track of the longest line. """
+        nonlocal report_max_length
+        report.append(line)
+        report_max_length = max(report_max_length, len(line))
+
     # Add misc details to report header
-    report.append("Date: %s" % now)
-    report.append("Pyacmecapture version: %s" % __version__)
-    report.append("Captured Channels: %s" % _CAPTURED_CHANNELS)
-    report.append("Oversampling ratio: %u" % _OVERSAMPLING_RATIO)
-    report.append("Asynchronous reads: %s" % _ASYNCHRONOUS_READS)
-    report.append("Power Rails: %u" % args.count)
-    report.append("Duration: %us\n" % args.duration)
+    add_report_line(f"Date: {now}")
+    add_report_line(f"Pyacmecapture version: {__version__}")
+    add_report_line(f"Captured Channels: {_CAPTURED_CHANNELS}")
+    add_report_line(f"Oversampling ratio: {_OVERSAMPLING_RATIO}")
+    add_report_line(f"Asynchronous reads: {_ASYNCHRONOUS_READS}")
+    add_report_line(f"Power Rails: {args.count}")
+    add_report_line(f"Duration: {args.duration}s\n")
 
     # Adjust column width with name so that it's never truncated
     cols_width = []
@@ -673,70 +876,55 @@ def main():
 
     # Generate report
     for r in table['rows']:
-        s = r.ljust(_REPORT_1ST_COL_WIDTH)
-        for i in range(args.count):
-            slot = data[i]['slot']
-            if r == 'Slot':
-                if args.names is not None:
-                    s += args.names[i].rjust(cols_width[i])
-                else:
-                    s += str(slot).rjust(cols_width[i])
-            elif r == 'Shunt (mohm)':
-                s += str(iio_acme_cape.get_shunt(slot) / 1000).rjust(
-                    cols_width[i])
-            elif table['data_keys'][r] is not None:
-                s += format(data[i][table['data_keys'][r]], '.1f').rjust(
-                    cols_width[i])
-        report.append(s)
+        # Select row cells once, then fill all power rails columns
+        data_key = table['data_keys'].get(r)
+        if r == 'Slot':
+            if args.names is not None:
+                cells = args.names
+            else:
+                cells = [str(d['slot']) for d in data]
+        elif r == 'Shunt (mohm)':
+            cells = [str(iio_acme_cape.get_shunt(d['slot']) / 1000)
+                     for d in data]
+        elif data_key is not None:
+            cells = [format(d[data_key], '.1f') for d in data]
+        else:
+            cells = []
+        add_report_line(r.ljust(_REPORT_1ST_COL_WIDTH) + "".join(
+            [cell.rjust(col_width)
+             for cell, col_width in zip(cells, cols_width)]))
 
     # Add output filenames to report
     trace_filenames = []
-    if args.nofile is False:
-        report.append("\nReport file: %s" % report_filename)
+    if nofile is False:
+        add_report_line(f"\nReport file: {report_filename}")
         for i in range(args.count):
             slot = data[i]['slot']
-            if args.out is None:
-                trace_filename = now
-            else:
-                trace_filename = args.out
-            trace_filename += "_"
             if args.names is not None:
-                trace_filename += args.names[i]
+                name = args.names[i]
+                trace_filename = os.path.join(
+                    outdir, f"{trace_prefix}_{name}.csv")
             else:
-                trace_filename += "Slot_%u" % slot
-            trace_filename += ".csv"
-            trace_filename = os.path.join(outdir, trace_filename)
-            if args.names is not None:
-                report.append("%s Trace file: %s" % (
-                    args.names[i], trace_filename))
-            else:
-                report.append("Slot %s Trace file: %s" % (
-                    slot, trace_filename))
+                name = f"Slot {slot}"
+                trace_filename = os.path.join(
+                    outdir, f"{trace_prefix}_Slot_{slot}.csv")
+            add_report_line(f"{name} Trace file: {trace_filename}")
             trace_filenames.append(trace_filename)
-    report_max_length = len(max(report, key=len))
-    dash_count = (report_max_length - len(" Power Measurement Report ")) / 2
-
     # Add dashlines at beginning and end of report
-    if report_max_length % 2 == 0:
-        report.insert(0,
-                      "-" * dash_count +
-                      " Power Measurement Report " +
-                      "-" * dash_count)
-    else:
-        report.insert(0,
-                      "-" * dash_count +
-                      " Power Measurement Report " +
-                      "-" * (dash_count + 1))
+    # (extra dash on the right when the title cannot be centered)
+    dash_count, extra_dash = divmod(
+        report_max_length - len(_REPORT_TITLE), 2)
+    report[0] = ("-" * dash_count +
+                 _REPORT_TITLE +
+                 "-" * (dash_count + extra_dash))
     report.append("-" * report_max_length)
 
     # Save report to file
-    if args.nofile is False:
+    if nofile is False:
         try:
-            of_report = open(report_filename, 'w')
-            for line in report:
-                print(line, file=of_report)
-            of_report.close()
-        except:
+            with open(report_filename, 'w') as of_report:
+                of_report.write("\n".join(report) + "\n")
+        except OSError:
             log(Fore.RED, "FAILED", "Save Power Measurement report")
             trace.trace(2, traceback.format_exc())
             exit_with_error(err)
@@ -744,46 +932,77 @@ def main():
             "Save Power Measurement report")
 
     # Save Power Measurement trace to file (CSV format)
-    if args.nofile is False:
-        for i in range(args.count):
-            slot = data[i]['slot']
-            trace.trace(1, "Trace file: %s" % trace_filenames[i])
+    def save_trace(i):
+        """ Save power rail trace to file (CSV format).
+
+        Args:
+            i: power rail index (in data list)
+
+        Returns:
+            Power rail name (used in trace header).
+
+        """
+        slot = data[i]['slot']
+        trace.trace(1, "Trace file: %s", trace_filenames[i])
+        time_ch = data[i]["Time"]
+        vbat_ch = data[i]["Vbat"]
+        ishunt_ch = data[i]["Ishunt"]
+        power_ch = data[i]["Power"]
+
+        # Format trace header (name columns)
+        if args.names is not None:
+            name = args.names[i]
+        else:
+            name = f"Slot {slot}"
+        s = (f"Time ({time_ch['unit']}), "
+             f"{name} Voltage ({vbat_ch['unit']}), "
+             f"{name} Current ({ishunt_ch['unit']}), "
+             f"{name} Power ({power_ch['unit']})")
+        header = (s + "\n").encode()
+        # Render all samples rows at once ('!s' keeps numpy's shortest
+        # float repr)
+        rows = zip(time_ch["samples"], vbat_ch["samples"],
+                   ishunt_ch["samples"], power_ch["samples"])
+        body = "".join(
+            f"{t!s}, {v!s}, {c!s}, {p!s}\n" for t, v, c, p in rows).encode()
+
+        if hasattr(os, 'writev'):
+            # Save header and samples in trace file with a single gather write
+            fd = os.open(trace_filenames[i],
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
             try:
-                of_trace = open(trace_filenames[i], 'w')
-            except:
-                log(Fore.RED, "FAILED", "Create output trace file")
+                written = os.writev(fd, [header, body])
+                # Short write: write remaining bytes of each buffer (no copy)
+                for buf in (header, body):
+                    remaining = memoryview(buf)[min(written, len(buf)):]
+                    written = max(written - len(buf), 0)
+                    while remaining:
+                        remaining = remaining[os.write(fd, remaining):]
+            finally:
+                os.close(fd)
+        else:
+            # No gather write available (non-POSIX host)
+            with open(trace_filenames[i], 'wb') as of_trace:
+                of_trace.write(header)
+                of_trace.write(body)
+        return name
+
+    if nofile is False:
+        # Trace files are independent: save them from a few worker threads.
+        # Formatting holds the GIL and runs one rail at a time; only the
+        # file writes (GIL released) run in parallel with it.
+        with ThreadPoolExecutor(
+                max_workers=min(args.count, os.cpu_count() or 1)) as executor:
+            futures = [executor.submit(save_trace, i)
+                       for i in range(args.count)]
+        for future in futures:
+            try:
+                name = future.result()
+            except OSError:
+                log(Fore.RED, "FAILED", "Save output trace file")
                 trace.trace(2, traceback.format_exc())
                 exit_with_error(err)
-
-            # Format trace header (name columns)
-            if args.names is not None:
-                s = "Time (%s), %s Voltage (%s), %s Current (%s), %s Power (%s)" % (
-                    data[i]["Time"]["unit"],
-                    args.names[i], data[i]["Vbat"]["unit"],
-                    args.names[i], data[i]["Ishunt"]["unit"],
-                    args.names[i], data[i]["Power"]["unit"])
-            else:
-                s = "Time (%s), Slot %u Voltage (%s), Slot %u Current (%s), Slot %u Power (%s)" % (
-                    data[i]["Time"]["unit"],
-                    slot, data[i]["Vbat"]["unit"],
-                    slot, data[i]["Ishunt"]["unit"],
-                    slot, data[i]["Power"]["unit"])
-            print(s, file=of_trace)
-            # Save samples in trace file
-            for j in range(len(data[i]["Ishunt"]["samples"])):
-                s = "%s, %s, %s, %s" % (
-                    data[i]["Time"]["samples"][j],
-                    data[i]["Vbat"]["samples"][j],
-                    data[i]["Ishunt"]["samples"][j],
-                    data[i]["Power"]["samples"][j])
-                print(s, file=of_trace)
-            of_trace.close()
-            if args.names is not None:
-                log(Fore.GREEN, "OK",
-                    "Save %s Power Measurement Trace" % args.names[i])
-            else:
-                log(Fore.GREEN, "OK",
-                    "Save Slot %u Power Measurement Trace" % slot)
+            log(Fore.GREEN, "OK", f"Save {name} Power Measurement Trace")
 
     # Display report
     print()